@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import time
+
+import numpy as np
+
+# Cosine similarity above which two queries are treated as the same search
+SIMILARITY_THRESHOLD = 0.95
+
+# Rows of the int8 matrix widened at a time during a lookup, bounding the int32
+# temporary to a small block instead of a full copy of the matrix
+_BLOCK_ROWS = 32
+
+@dataclass
+class _Entry:
+    """A cached search result and the int8 embedding of the query that produced it."""
+    result: str
+    expires_at: float
+    embedding: np.ndarray | None
+    scale: float = 1.0
+
+class SearchCache:
+    """
+    Bounded LRU cache of formatted search results.
+
+    Lookups first try an exact match on the (query, limit, min_score) key and
+    then fall back to the cached query whose embedding is most similar to the
+    new one, so near-duplicate queries skip the embed + vector search round trip.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0, threshold: float = SIMILARITY_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        # Quantized query embeddings stacked row-wise as int8 with their per-row
+        # scales, aligned with _keys; rebuilt lazily
+        self._keys: list[tuple] = []
+        self._matrix: np.ndarray | None = None
+        self._scales: np.ndarray | None = None
+        self._dirty = False
+        # Bumped by clear(); results computed before a clear are not stored
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Counter to capture before a search and pass back to put()."""
+        return self._generation
+
+    def get(self, key: tuple) -> str | None:
+        """Return the cached result for an exact key, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.result
+
+    def get_similar(self, embedding, limit: int, min_score: float) -> str | None:
+        """
+        Return the result of the most similar cached query with the same search parameters.
+
+        Args:
+            embedding: Embedding of the new query
+            limit: The search limit the result must have been produced with
+            min_score: The minimum score the result must have been produced with
+        """
+        if self._dirty:
+            self._rebuild()
+        if self._matrix is None:
+            return None
+
+        # Accumulate in int32: int8 x int8 products summed over ~1k dims overflow int16
+        query, query_scale = _quantize(embedding)
+        query = query.astype(np.int32)
+        scores = np.empty(len(self._keys), dtype=np.float32)
+        for start in range(0, len(scores), _BLOCK_ROWS):
+            block = self._matrix[start:start + _BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.int32) @ query
+        scores *= self._scales * query_scale
+        for i in np.argsort(-scores):
+            if scores[i] <= self.threshold:
+                break
+            key = self._keys[i]
+            if key[1:] != (limit, min_score):
+                continue
+            result = self.get(key)
+            if result is not None:
+                return result
+        return None
+
+    def put(self, key: tuple, result: str, embedding=None, generation: int | None = None) -> None:
+        """
+        Store a result, evicting the least recently used entry when full.
+
+        Args:
+            key: The (query, limit, min_score) key
+            result: The formatted search result
+            embedding: Embedding of the query, used for similarity lookups
+            generation: The generation captured before the search; the result is
+                dropped if the cache was cleared since, as it may predate a save
+        """
+        if generation is not None and generation != self._generation:
+            return
+        entry = _Entry(result=result, expires_at=time.monotonic() + self.ttl, embedding=None)
+        if embedding is not None:
+            entry.embedding, entry.scale = _quantize(embedding)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def clear(self) -> None:
+        """Drop every cached result, e.g. after the stored memories change."""
+        self._generation += 1
+        self._entries.clear()
+        self._keys = []
+        self._matrix = None
+        self._scales = None
+        self._dirty = False
+
+    def _remove(self, key: tuple) -> None:
+        del self._entries[key]
+        self._dirty = True
+
+    def _rebuild(self) -> None:
+        self._keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+        if self._keys:
+            self._matrix = np.stack([self._entries[key].embedding for key in self._keys])
+            self._scales = np.array([self._entries[key].scale for key in self._keys], dtype=np.float32)
+        else:
+            self._matrix = None
+            self._scales = None
+        self._dirty = False
+
+def _quantize(embedding) -> tuple[np.ndarray, float]:
+    """Normalize an embedding and quantize it to int8 with a symmetric per-vector scale."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector = vector / norm
+    peak = float(np.abs(vector).max(initial=0.0))
+    scale = peak / 127 if peak else 1.0
+    return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
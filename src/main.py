@@ -1,77 +1,179 @@
 from mcp.server.fastmcp import FastMCP, Context
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from dotenv import load_dotenv
+from functools import lru_cache, partial
 from mem0 import Memory
+from numba import njit
 import asyncio
-import json
-import os
-
-from utils import get_mem0_client
+import logging
+import numpy as np
+import orjson
 import re
 
+from cache import SearchCache
+from utils import get_mem0_client, settings
+
 def clean_mem0_response(response):
     """Clean and extract text from complex mem0 response structure."""
     if not response:
         return ""
     
-    # If already a simple string, return as-is
-    if isinstance(response, str) and not response.startswith(('[', '{')):
+    # Current mem0 versions return {"results": [{"memory": ..., "event": ...}, ...]}
+    # directly; add results carry an ADD/UPDATE/DELETE event worth reporting
+    if isinstance(response, dict) and isinstance(response.get('results'), list):
+        lines = []
+        for r in response['results']:
+            if not isinstance(r, dict):
+                continue
+            memory = r.get('memory')
+            if not memory:
+                continue
+            event = r.get('event')
+            lines.append(f"{event}: {memory}" if event else memory)
+        return '\n'.join(lines)
+    
+    if isinstance(response, bytes):
+        response = response.decode()
+    
+    # Identical string responses recur often, so those go through the cached path
+    if isinstance(response, str):
+        return _clean_str(response)
+    
+    try:
+        return _extract_text(response)
+    except TypeError:
+        return str(response)
+
+@lru_cache(maxsize=512)
+def _clean_str(response: str) -> str:
+    """Parse a string response that may contain JSON and extract its text."""
+    # Remove Tool execution result prefix if present, before the JSON check
+    # below so a prefixed JSON payload still gets parsed
+    response = response.removeprefix('Tool execution result: ')
+    
+    # If already a simple string, return as-is; a leading quote may be a
+    # double-encoded payload (a JSON string holding JSON)
+    if not response.startswith(('[', '{', '"')):
         return response
     
     try:
-        # Handle string responses that may contain JSON
-        if isinstance(response, str):
-            # Remove Tool execution result prefix if present
-            if response.startswith('Tool execution result:'):
-                response = response.replace('Tool execution result: ', '')
-            
-            # Unescape any escaped JSON strings
-            response = re.sub(r'\\"', '"', response)
-            response = re.sub(r'\\n', '\n', response)
-            response = re.sub(r'\\u([0-9a-fA-F]{4})', 
-                            lambda m: chr(int(m.group(1), 16)), response)
-            
-            # Parse the JSON
-            parsed = json.loads(response)
-        else:
-            parsed = response
+        # Parse the JSON - orjson.loads already handles escape sequences
+        parsed = orjson.loads(response)
         
-        # Extract text from different response formats
-        if isinstance(parsed, list):
-            texts = []
-            for item in parsed:
-                if isinstance(item, dict):
-                    text = item.get('text', '')
-                    if text:
-                        # Recursively clean nested text
-                        texts.append(clean_mem0_response(text))
-                elif isinstance(item, str):
-                    texts.append(item)
-            return '\n'.join(texts)
-        
-        elif isinstance(parsed, dict):
-            text = parsed.get('text', '')
-            if text:
-                return clean_mem0_response(text)
-            return str(parsed)
+        # Unwrap double-encoded responses (a JSON string holding JSON)
+        if isinstance(parsed, str) and parsed.startswith(('[', '{')):
+            parsed = orjson.loads(parsed)
         
+        return _extract_text(parsed)
+    except (orjson.JSONDecodeError, TypeError):
+        return str(response)
+
+def _extract_text(parsed) -> str:
+    """Extract text from the different parsed response formats."""
+    if isinstance(parsed, list):
+        texts = []
+        for item in parsed:
+            if isinstance(item, dict):
+                text = item.get('text', '')
+                if text:
+                    # Recursively clean nested text
+                    texts.append(clean_mem0_response(text))
+            elif isinstance(item, str):
+                texts.append(item)
+        return '\n'.join(texts)
+    
+    elif isinstance(parsed, dict):
+        text = parsed.get('text', '')
+        if text:
+            return clean_mem0_response(text)
         return str(parsed)
     
-    except (json.JSONDecodeError, TypeError):
-        return str(response)
+    return str(parsed)
 
-load_dotenv()
+log = logging.getLogger("mcp_mem0")
+log.setLevel(settings.log_level)
 
 # Default user ID for memory operations
 DEFAULT_USER_ID = "user"
 
+# Stopwords stripped from search queries before embedding
+STOPWORDS = frozenset(('的', '是', '在', '和', '有'))
+_STOPWORD_RE = re.compile(r'(?:^|\s)(?:' + '|'.join(map(re.escape, STOPWORDS)) + r')(?=\s|$)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Saves already pending when the batch writer wakes up are coalesced into one
+# mem0 add call, up to this many messages. Tool calls run concurrently within
+# and across sessions, so saves pile up while an add is in flight and go out
+# together in the next batch; there is no fixed collection window, so a save
+# that arrives while the writer is idle is not delayed
+BATCH_MAX_SIZE = 16
+
+# Worker threads for blocking Mem0 calls (LLM, embedding and database I/O)
+MAX_WORKERS = 16
+
+# Search results are shared by every session, like the Mem0 client they come
+# from, so a save in one session invalidates them for all of them
+search_cache = SearchCache()
+
+# Thread pool and write queue are process-wide too, so saves from different
+# sessions can share a batch; the writer task starts with the first session
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mem0")
+write_queue: asyncio.Queue = asyncio.Queue()
+_writer: asyncio.Task | None = None
+
 # Create a dataclass for our application context
 @dataclass
 class Mem0Context:
     """Context for the Mem0 MCP server."""
     mem0_client: Memory
+    search_cache: SearchCache
+    write_queue: asyncio.Queue
+    executor: ThreadPoolExecutor
+
+async def run_blocking(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    """Run a blocking Mem0 call on the shared thread pool so it doesn't stall the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+async def batch_writer(mem0_client: Memory, queue: asyncio.Queue, executor: ThreadPoolExecutor, cache: SearchCache) -> None:
+    """
+    Drains queued save requests and submits them to Mem0 in batches.
+    
+    Each queue item is a (text, future) pair. Every future in a batch is
+    resolved with (result, batch_size) for the shared add call, or its exception;
+    mem0 doesn't say which messages each result came from, so callers must not
+    report a result shared by more than one message.
+    
+    Args:
+        mem0_client: The Mem0 client to write to
+        queue: The queue save_memory puts pending writes on
+        executor: The thread pool the blocking add call runs on
+        cache: The search cache to invalidate after each successful write
+    """
+    while True:
+        batch = [await queue.get()]
+        # Yield once so handlers already runnable alongside this one can enqueue
+        # their saves, then take whatever is pending without waiting for more
+        await asyncio.sleep(0)
+        while len(batch) < BATCH_MAX_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        
+        messages = [{"role": "user", "content": text} for text, _ in batch]
+        try:
+            result = await run_blocking(executor, mem0_client.add, messages, user_id=DEFAULT_USER_ID)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            # Stored memories changed, so cached search results may be stale; done
+            # here so it happens even if every waiting caller was cancelled
+            cache.clear()
+            for _, future in batch:
+                if not future.done():
+                    future.set_result((result, len(batch)))
 
 @asynccontextmanager
 async def mem0_lifespan(server: FastMCP) -> AsyncIterator[Mem0Context]:
@@ -84,13 +186,25 @@ async def mem0_lifespan(server: FastMCP) -> AsyncIterator[Mem0Context]:
     Yields:
         Mem0Context: The context containing the Mem0 client
     """
+    global _writer
+    
     # Create and return the Memory client with the helper function in utils.py
-    mem0_client = get_mem0_client()
+    mem0_client = get_mem0_client(settings)
+    
+    # Start the background task that batches writes to Mem0 once per process;
+    # it outlives individual sessions and stops with the event loop
+    if _writer is None or _writer.done():
+        _writer = asyncio.create_task(batch_writer(mem0_client, write_queue, executor, search_cache))
     
     try:
-        yield Mem0Context(mem0_client=mem0_client)
+        yield Mem0Context(
+            mem0_client=mem0_client,
+            search_cache=search_cache,
+            write_queue=write_queue,
+            executor=executor
+        )
     finally:
-        # No explicit cleanup needed for the Mem0 client
+        # No explicit cleanup needed for the Mem0 client or the shared writer
         pass
 
 # Initialize FastMCP server with the Mem0 client as context
@@ -98,8 +212,8 @@ mcp = FastMCP(
     "mcp-mem0",
     description="MCP server for long term memory storage and retrieval with Mem0",
     lifespan=mem0_lifespan,
-    host=os.getenv("HOST", "0.0.0.0"),
-    port=os.getenv("PORT", "8050")
+    host=settings.host,
+    port=settings.port
 )        
 
 @mcp.tool()
@@ -114,24 +228,32 @@ async def save_memory(ctx: Context, text: str) -> str:
         text: The content to store in memory, including any relevant details and context
     """
     try:
-        mem0_client = ctx.request_context.lifespan_context.mem0_client
-        messages = [{"role": "user", "content": text}]
-        print(f"Attempting to save memory: {text[:100]}...")  # Debug log
+        write_queue = ctx.request_context.lifespan_context.write_queue
+        saved_message = f"Successfully saved memory: {text[:100]}..." if len(text) > 100 else f"Successfully saved memory: {text}"
+        log.debug("Attempting to save memory: %.100s", text)
         try:
-            result = mem0_client.add(messages, user_id=DEFAULT_USER_ID)
-            print(f"Save memory result type: {type(result)}")  # Debug log
-            print(f"Save memory result content: {result}")  # Debug log
+            # Hand the write to the batch writer and wait for its result
+            future = asyncio.get_running_loop().create_future()
+            await write_queue.put((text, future))
+            result, batch_size = await future
+            log.debug("Save memory result: %r", result)
             if result is None:
                 return "Failed to save memory: No result returned"
             
-            # Clean and extract text from the response
-            cleaned = clean_mem0_response(result)
+            # A result shared with other saves (possibly from other sessions) holds
+            # their memories too, so only report it when this text was alone
+            if batch_size > 1:
+                return saved_message
+            
+            # Clean and extract text from raw string responses and report the memories
+            # mem0 extracted from {"results": [...]} dicts
+            cleaned = clean_mem0_response(result) if isinstance(result, (str, bytes, dict)) else None
             if cleaned:
                 return cleaned
             
-            return f"Successfully saved memory: {text[:100]}..." if len(text) > 100 else f"Successfully saved memory: {text}"
+            return saved_message
         except Exception as e:
-            print(f"Error saving memory: {str(e)}")  # Debug log
+            log.error("Error saving memory: %s", e)
             return f"Error saving memory: {str(e)}"
     except Exception as e:
         return f"Error saving memory: {str(e)}"
@@ -150,12 +272,14 @@ async def get_all_memories(ctx: Context) -> str:
     """
     try:
         mem0_client = ctx.request_context.lifespan_context.mem0_client
-        memories = mem0_client.get_all(user_id=DEFAULT_USER_ID)
+        executor = ctx.request_context.lifespan_context.executor
+        memories = await run_blocking(executor, mem0_client.get_all, user_id=DEFAULT_USER_ID)
         if isinstance(memories, dict) and "results" in memories:
             flattened_memories = [memory["memory"] for memory in memories["results"]]
         else:
             flattened_memories = memories
-        return json.dumps(flattened_memories, indent=2)
+        # Compact encoding - indentation only inflates the payload for the client
+        return orjson.dumps(flattened_memories).decode()
     except Exception as e:
         return f"Error retrieving memories: {str(e)}"
 
@@ -174,65 +298,113 @@ async def search_memories(ctx: Context, query: str, limit: int = 3, min_score: f
     """
     try:
         mem0_client = ctx.request_context.lifespan_context.mem0_client
+        search_cache = ctx.request_context.lifespan_context.search_cache
+        executor = ctx.request_context.lifespan_context.executor
         
         # Preprocess query - remove stopwords and normalize
-        processed_query = ' '.join([word for word in query.split() 
-                                  if word.lower() not in ['的', '是', '在', '和', '有']])
+        processed_query = _WHITESPACE_RE.sub(' ', _STOPWORD_RE.sub('', query)).strip()
+        
+        # Serve repeated queries straight from the cache; the generation is taken
+        # first so a save that lands mid-search keeps its result out of the cache
+        generation = search_cache.generation
+        cache_key = (processed_query, limit, min_score)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Fall back to the most similar cached query before hitting the vector store;
+        # on a miss the query is embedded again inside Memory.search, which is kept
+        # over calling mem0's vector store directly so graph search, output format
+        # handling and filter building stay mem0's concern
+        embedding = await run_blocking(executor, mem0_client.embedding_model.embed, processed_query, "search")
+        cached = search_cache.get_similar(embedding, limit, min_score)
+        if cached is not None:
+            return cached
         
-        print(f"Searching memories with query: {processed_query}")  # Debug log
+        log.debug("Searching memories with query: %s", processed_query)
         
         # Search with enhanced parameters
-        memories = mem0_client.search(
+        memories = await run_blocking(
+            executor,
+            mem0_client.search,
             processed_query, 
             user_id=DEFAULT_USER_ID, 
             limit=limit*2  # Get more results to filter
         )
         
-        cleaned = clean_mem0_response(memories)
-        if cleaned:
-            return cleaned
-        
-        results = []
-        if isinstance(memories, dict):
-            if "results" in memories:
-                for memory in memories.get("results", []):
-                    if memory.get("score", 0) >= min_score:
-                        results.append({
-                            "text": memory.get("memory"),
-                            "score": memory.get("score"),
-                            "timestamp": memory.get("timestamp")
-                        })
-            elif "facts" in memories:
-                results = memories.get("facts", [])
-            else:
-                results = [memories]
-        else:
-            results = memories if isinstance(memories, list) else [memories]
-        
-        # Sort by score descending
-        if all(isinstance(r, dict) and 'score' in r for r in results):
-            results.sort(key=lambda x: x['score'], reverse=True)
-        
-        # Apply limit after filtering
-        results = results[:limit]
-        
-        # Format output with scores
-        output = []
-        for result in results:
-            if isinstance(result, dict):
-                score = result.get('score', 'N/A')
-                text = result.get('text', result.get('memory', str(result)))
-                output.append(f"[相似度: {score:.2f}] {text}")
-            else:
-                output.append(str(result))
-                
-        return "\n\n".join(output) if output else "未找到相关记忆"
+        output = format_search_results(memories, limit, min_score)
+        search_cache.put(cache_key, output, embedding, generation)
+        return output
     except Exception as e:
         return f"Error searching memories: {str(e)}"
 
+# Explicit signature compiles at import instead of on the first search, where
+# LLVM compile time would block the event loop on a cold numba cache
+@njit("int64[:](float64[:], float64, int64)", cache=True, fastmath=True)
+def top_k_indices(scores: np.ndarray, min_score: float, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores at or above min_score, best first."""
+    # Filter into a preallocated buffer, then sort only the survivors
+    keep = np.empty(scores.size, dtype=np.int64)
+    n = 0
+    for i in range(scores.size):
+        if scores[i] >= min_score:
+            keep[n] = i
+            n += 1
+    keep = keep[:n]
+    order = np.argsort(-scores[keep], kind="mergesort")
+    return keep[order[:max(k, 0)]]
+
+def format_search_results(memories, limit: int, min_score: float) -> str:
+    """Filter, rank and format raw mem0 search results for the client."""
+    # Only raw string responses need cleaning; dicts and lists are walked below
+    cleaned = clean_mem0_response(memories) if isinstance(memories, (str, bytes)) else None
+    if cleaned:
+        return cleaned
+    
+    results = []
+    if isinstance(memories, dict):
+        if "results" in memories:
+            candidates = memories.get("results", [])
+            scores = np.fromiter(
+                (memory.get("score") or 0.0 for memory in candidates),
+                dtype=np.float64,  # float32 would round scores equal to min_score below it
+                count=len(candidates)
+            )
+            for i in top_k_indices(scores, min_score, limit):
+                memory = candidates[i]
+                results.append({
+                    "text": memory.get("memory"),
+                    "score": memory.get("score"),
+                    "timestamp": memory.get("timestamp")
+                })
+        elif "facts" in memories:
+            results = memories.get("facts", [])
+        else:
+            results = [memories]
+    else:
+        results = memories if isinstance(memories, list) else [memories]
+    
+    # Sort by score descending
+    if all(isinstance(r, dict) and 'score' in r for r in results):
+        results.sort(key=lambda x: x['score'], reverse=True)
+    
+    # Apply limit after filtering
+    results = results[:limit]
+    
+    # Format output with scores
+    output = []
+    for result in results:
+        if isinstance(result, dict):
+            score = result.get('score', 'N/A')
+            text = result.get('text', result.get('memory', str(result)))
+            output.append(f"[相似度: {score:.2f}] {text}")
+        else:
+            output.append(str(result))
+            
+    return "\n\n".join(output) if output else "未找到相关记忆"
+
 async def main():
-    transport = os.getenv("TRANSPORT", "sse")
-    if transport == 'sse':
+    if settings.transport == 'sse':
         # Run the MCP server with sse transport
         await mcp.run_sse_async()
     else:
@@ -240,4 +412,11 @@ async def main():
         await mcp.run_stdio_async()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop has to be in place before the event loop starts, so it is picked
+    # here rather than inside main(); it isn't available on Windows
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
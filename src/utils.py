@@ -1,4 +1,8 @@
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from functools import lru_cache
 from mem0 import Memory
+import logging
 import os
 
 # Custom instructions for memory processing
@@ -14,44 +18,130 @@ Extract the Following Information:
 - Source: Record where this information came from when applicable.
 """
 
-def get_mem0_client():
-    # Get LLM provider and configuration
-    llm_provider = os.getenv('LLM_PROVIDER')
-    llm_api_key = os.getenv('LLM_API_KEY')
-    llm_model = os.getenv('LLM_CHOICE')
-    llm_base_url = os.getenv('LLM_BASE_URL')
-    embedding_model = os.getenv('EMBEDDING_MODEL_CHOICE')
+@dataclass(frozen=True)
+class Settings:
+    """Server and Mem0 configuration, read from the environment once at import."""
+    transport: str
+    host: str
+    port: int
+    log_level: str
+    llm_provider: str | None
+    llm_api_key: str | None
+    llm_model: str | None
+    llm_base_url: str | None
+    embedding_model: str | None
+    embedding_api_key: str | None
+    embedding_base_url: str | None
+    embedding_dims: int
+    database_url: str
+
+def _log_level(value: str | None) -> str:
+    # Unknown level names would make logging raise at import, so fall back to INFO
+    level = (value or 'INFO').upper()
+    return level if level in logging.getLevelNamesMapping() else 'INFO'
+
+def _load_settings() -> Settings:
+    return Settings(
+        transport=os.getenv('TRANSPORT') or 'sse',
+        host=os.getenv('HOST') or '0.0.0.0',
+        port=int(os.getenv('PORT') or 8050),
+        log_level=_log_level(os.getenv('LOG_LEVEL')),
+        llm_provider=os.getenv('LLM_PROVIDER'),
+        llm_api_key=os.getenv('LLM_API_KEY'),
+        llm_model=os.getenv('LLM_CHOICE'),
+        llm_base_url=os.getenv('LLM_BASE_URL'),
+        embedding_model=os.getenv('EMBEDDING_MODEL_CHOICE'),
+        embedding_api_key=os.getenv('EMBEDDING_API_KEY'),
+        embedding_base_url=os.getenv('EMBEDDING_BASE_URL'),
+        embedding_dims=int(os.getenv('EMBEDDING_DIMS') or 1024),
+        database_url=os.getenv('DATABASE_URL', ''),
+    )
+
+load_dotenv()
+settings = _load_settings()
+
+def _build_deepseek(settings: Settings) -> dict:
+    return {
+        "provider": "openai",
+        "config": {
+            "model": settings.llm_model or "deepseek-chat",
+            "temperature": 0.2,
+            "max_tokens": 2000
+        }
+    }
+
+def _build_openai(settings: Settings) -> dict:
+    return {
+        "provider": "openai",
+        "config": {
+            "model": settings.llm_model,
+            "temperature": 0.2,
+            "max_tokens": 2000,
+        }
+    }
+
+def _build_ollama(settings: Settings) -> dict:
+    llm = {
+        "provider": "ollama",
+        "config": {
+            "model": settings.llm_model,
+            "temperature": 0.2,
+            "max_tokens": 2000,
+        }
+    }
     
-    # Initialize config dictionary
-    config = {}
+    # Set base URL for Ollama if provided
+    if settings.llm_base_url:
+        llm["config"]["ollama_base_url"] = settings.llm_base_url
+    return llm
+
+# LLM config builders keyed by LLM_PROVIDER (OpenRouter is OpenAI compatible)
+_PROVIDERS = {
+    'deepseek': _build_deepseek,
+    'openai': _build_openai,
+    'openrouter': _build_openai,
+    'ollama': _build_ollama,
+}
+
+def _build_embedder(settings: Settings) -> dict:
+    # 单独配置向量模型服务
+    if settings.embedding_base_url:
+        return {
+            "provider": "ollama",
+            "config": {
+                "model": settings.embedding_model or "nomic-embed-text",
+                "embedding_dims": settings.embedding_dims,
+                "ollama_base_url": settings.embedding_base_url
+            }
+        }
+    
+    embedder = {
+        "provider": "openai",
+        "config": {
+            "model": settings.embedding_model or "text-embedding-3-small",
+            "embedding_dims": settings.embedding_dims
+        }
+    }
+    
+    # Pass a separate embedding key directly so it works with any LLM provider
+    # without replacing the key the LLM client reads from the environment
+    if settings.embedding_api_key:
+        embedder["config"]["api_key"] = settings.embedding_api_key
+    return embedder
+
+def _export_credentials(settings: Settings) -> None:
+    """Set the environment variables the OpenAI compatible clients read their credentials from."""
+    llm_provider = settings.llm_provider
+    llm_api_key = settings.llm_api_key
     
-    # Configure LLM based on provider
     if llm_provider == 'deepseek':
         # 设置环境变量供OpenAI客户端使用
         if llm_api_key:
             os.environ["OPENAI_API_KEY"] = llm_api_key
-        if llm_base_url:
-            os.environ["OPENAI_BASE_URL"] = llm_base_url
-            
-        config["llm"] = {
-            "provider": "openai",
-            "config": {
-                "model": llm_model or "deepseek-chat",
-                "temperature": 0.2,
-                "max_tokens": 2000
-            }
-        }
-            
-    elif llm_provider == 'openai' or llm_provider == 'openrouter':
-        config["llm"] = {
-            "provider": "openai",
-            "config": {
-                "model": llm_model,
-                "temperature": 0.2,
-                "max_tokens": 2000,
-            }
-        }
-        
+        if settings.llm_base_url:
+            os.environ["OPENAI_BASE_URL"] = settings.llm_base_url
+    
+    elif llm_provider in ('openai', 'openrouter'):
         # Set API key in environment if not already set
         if llm_api_key and not os.environ.get("OPENAI_API_KEY"):
             os.environ["OPENAI_API_KEY"] = llm_api_key
@@ -59,57 +149,28 @@ def get_mem0_client():
         # For OpenRouter, set the specific API key
         if llm_provider == 'openrouter' and llm_api_key:
             os.environ["OPENROUTER_API_KEY"] = llm_api_key
+
+# Building the client sets up LLM, embedding and database connections, so it is
+# done once per process and shared by every session's lifespan
+@lru_cache(maxsize=1)
+def get_mem0_client(settings: Settings):
+    _export_credentials(settings)
     
-    elif llm_provider == 'ollama':
-        config["llm"] = {
-            "provider": "ollama",
-            "config": {
-                "model": llm_model,
-                "temperature": 0.2,
-                "max_tokens": 2000,
-            }
-        }
-        
-        # Set base URL for Ollama if provided
-        llm_base_url = os.getenv('LLM_BASE_URL')
-        if llm_base_url:
-            config["llm"]["config"]["ollama_base_url"] = llm_base_url
-    
-    # Configure embedder based on provider
-    embedding_api_key = os.getenv('EMBEDDING_API_KEY')
+    # Initialize config dictionary
+    config = {}
     
-    if llm_provider == 'openai':
-        config["embedder"] = {
-            "provider": "openai",
-            "config": {
-                "model": embedding_model or "text-embedding-3-small",
-                "embedding_dims": 1024  # Default for text-embedding-3-small
-            }
-        }
-        
-        # Set API key in environment if not already set
-        if embedding_api_key:
-            os.environ["OPENAI_API_KEY"] = embedding_api_key
-        elif llm_api_key and not os.environ.get("OPENAI_API_KEY"):
-            os.environ["OPENAI_API_KEY"] = llm_api_key
+    # Configure LLM based on provider, leaving Mem0's default for unknown providers
+    builder = _PROVIDERS.get(settings.llm_provider)
+    if builder:
+        config["llm"] = builder(settings)
     
-    # 单独配置向量模型服务
-    embedding_base_url = os.getenv('EMBEDDING_BASE_URL')
-    if embedding_base_url:
-        config["embedder"] = {
-            "provider": "ollama",
-            "config": {
-                "model": os.getenv('EMBEDDING_MODEL_CHOICE') or "nomic-embed-text",
-                "embedding_dims": int(os.getenv('EMBEDDING_DIMS') or 1024),
-                "ollama_base_url": embedding_base_url
-            }
-        }
+    config["embedder"] = _build_embedder(settings)
     
     # Configure Supabase vector store
     config["vector_store"] = {
         "provider": "supabase",
         "config": {
-            "connection_string": os.environ.get('DATABASE_URL', ''),
+            "connection_string": settings.database_url,
             "collection_name": "mem0_memories",
             "embedding_model_dims": 1024  # 统一使用1024维度
         }